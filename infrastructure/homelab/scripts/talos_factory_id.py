@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
-import sys, json, requests
+import os, sys, json, mmap, requests
+from requests.adapters import HTTPAdapter
+try:
+    import orjson
+    _loads, _dumps = orjson.loads, lambda o: orjson.dumps(o).decode()
+except ImportError:
+    _loads, _dumps = json.loads, json.dumps
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
 def main():
-    q = json.load(sys.stdin)
+    q = _loads(sys.stdin.buffer.read())
     path = q["path"]
     url  = q.get("url", "https://factory.talos.dev/schematics")
     with open(path, "rb") as f:
-        r = requests.post(url, data=f.read(), timeout=60)
+        # mmap refuses empty files
+        if os.fstat(f.fileno()).st_size == 0:
+            r = SESSION.post(url, data=b"", timeout=60)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as body:
+                r = SESSION.post(url, data=body, timeout=60)
     r.raise_for_status()
-    print(json.dumps({"id": r.json()["id"]}))
+    print(_dumps({"id": r.json()["id"]}))
 if __name__ == "__main__":
     main()
\ No newline at end of file
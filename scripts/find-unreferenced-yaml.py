@@ -6,11 +6,15 @@ This script helps identify orphaned YAML files in a Kustomize-based project by
 analyzing kustomization.yaml files to find unreferenced resources.
 """
 
+import codecs
+import functools
+import mmap
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Set, List
+from typing import FrozenSet, NamedTuple, Set, List
 from dataclasses import dataclass
 from enum import Enum
 
@@ -30,6 +34,70 @@ except ImportError:
     print("   pip install pyyaml", file=sys.stderr)
     sys.exit(1)
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+    print("Note: libyaml not available, falling back to the slower pure-Python YAML loader.", file=sys.stderr)
+    print("      Install libyaml-dev and reinstall PyYAML for faster parsing.", file=sys.stderr)
+
+
+class KustomizeDirectory(NamedTuple):
+    """A directory holding a kustomization.yaml and its sibling YAML files."""
+    directory: Path
+    kustomization_path: Path
+    yaml_files: List[str]
+
+
+def _scandir_recursive(root):
+    """Yield a KustomizeDirectory for each kustomize directory under root.
+
+    A single os.scandir pass per directory finds both the kustomization.yaml
+    and its sibling YAML files, so no directory is listed twice.
+    """
+    subdirs = []
+    yaml_names = []
+    has_kustomization = False
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name == 'kustomization.yaml':
+                    # kustomize itself follows a symlinked kustomization.yaml
+                    has_kustomization = entry.is_file()
+                elif entry.name.endswith(('.yaml', '.yml')) and entry.is_file(follow_symlinks=False):
+                    yaml_names.append(entry.name)
+    except PermissionError as e:
+        print(f"Skipping {root}: {e}", file=sys.stderr)
+        return
+
+    if has_kustomization:
+        directory = Path(root)
+        yield KustomizeDirectory(directory, directory / 'kustomization.yaml', yaml_names)
+
+    for subdir in subdirs:
+        yield from _scandir_recursive(subdir)
+
+
+class _NeedsFullLoad(Exception):
+    """Raised when a kustomization can't be scanned event by event."""
+
+
+_RESOLVER = yaml.resolver.Resolver()
+
+
+def _resolve_tag(event) -> str:
+    """Resolve the tag of a scalar event the way SafeLoader would."""
+    if event.tag in (None, '!'):
+        return _RESOLVER.resolve(yaml.ScalarNode, event.value, event.implicit)
+    return event.tag
+
+
+def _scalar_value(event):
+    """Return the scalar's text if it would load as a string, else None."""
+    return event.value if _resolve_tag(event) == 'tag:yaml.org,2002:str' else None
+
 
 class FileStatus(Enum):
     """Categorization of unreferenced files."""
@@ -43,17 +111,18 @@ class AnalysisResult:
     filepath: Path
     status: FileStatus
     reason: str
+    rel_path: str = ''
 
 
 class KustomizationParser:
     """Parses kustomization.yaml files to extract referenced resources."""
 
     # Fields in kustomization.yaml that can reference files
-    FILE_REFERENCE_FIELDS = [
+    FILE_REFERENCE_FIELDS = frozenset({
         'resources', 'patches', 'patchesStrategicMerge', 'patchesJson6902',
         'configurations', 'crds', 'openapi', 'generators', 'transformers',
         'components', 'configMapGenerator', 'secretGenerator'
-    ]
+    })
 
     def __init__(self, kustomization_path: Path):
         self.kustomization_path = kustomization_path
@@ -61,16 +130,33 @@ class KustomizationParser:
 
     def get_referenced_files(self) -> Set[str]:
         """Extract all referenced files from the kustomization.yaml."""
+        try:
+            st = self.kustomization_path.stat()
+        except OSError as e:
+            print(f"Error reading {self.kustomization_path}: {e}", file=sys.stderr)
+            return set()
+
+        return set(_cached_referenced_files(str(self.kustomization_path), st.st_mtime_ns, st.st_size))
+
+    def _read_referenced_files(self) -> Set[str]:
+        """Read and parse the kustomization.yaml, bypassing the cache."""
         referenced = set()
 
         try:
             content = self.kustomization_path.read_text(encoding='utf-8')
 
-            # Try to parse as YAML first
+            # Try to scan the YAML event stream first; references are only
+            # kept once the whole stream has parsed cleanly
             try:
-                data = yaml.safe_load(content)
-                if isinstance(data, dict):
-                    self._parse_yaml_references(data, referenced)
+                found = set()
+                try:
+                    self._parse_yaml_references(content, found)
+                except _NeedsFullLoad:
+                    found = set()
+                    data = yaml.load(content, Loader=_Loader)
+                    if isinstance(data, dict):
+                        self._parse_yaml_data(data, found)
+                referenced |= found
             except yaml.YAMLError:
                 # Fallback to regex if YAML parsing fails
                 self._parse_regex_references(content, referenced)
@@ -80,19 +166,131 @@ class KustomizationParser:
 
         return referenced
 
-    def _parse_yaml_references(self, data: dict, referenced: Set[str]) -> None:
-        """Parse YAML data to extract file references."""
-        for field in self.FILE_REFERENCE_FIELDS:
-            if field in data and data[field]:
-                if isinstance(data[field], list):
-                    for item in data[field]:
-                        self._extract_file_reference(item, referenced)
-
-        # Handle patches with target
-        if 'patches' in data and isinstance(data['patches'], list):
-            for patch in data['patches']:
-                if isinstance(patch, dict) and 'path' in patch:
-                    self._add_local_file(patch['path'], referenced)
+    def _parse_yaml_data(self, data: dict, referenced: Set[str]) -> None:
+        """Extract file references from a fully loaded YAML document."""
+        for field, value in data.items():
+            if field in self.FILE_REFERENCE_FIELDS and isinstance(value, list):
+                for item in value:
+                    self._extract_file_reference(item, referenced)
+
+                    # Handle patches with target
+                    if field == 'patches' and isinstance(item, dict) and 'path' in item:
+                        self._add_local_file(item['path'], referenced)
+
+    def _parse_yaml_references(self, content: str, referenced: Set[str]) -> None:
+        """Scan YAML events to extract file references.
+
+        Only the top-level reference fields are materialized; everything else
+        is skipped at the event level instead of being built into objects.
+        Raises _NeedsFullLoad for constructs whose meaning depends on the
+        composed document (aliases, merge keys, custom tags, multiple documents).
+        """
+        events = self._checked_events(content)
+        for event in events:
+            if isinstance(event, yaml.MappingStartEvent):
+                self._scan_top_level(events, referenced)
+                break
+            if isinstance(event, yaml.NodeEvent):
+                # Top-level node is not a mapping
+                self._skip_node(event, events)
+                break
+
+        # Drain the stream so syntax errors and extra documents still surface
+        for _ in events:
+            pass
+
+    @staticmethod
+    def _checked_events(content: str):
+        """Yield parse events, bailing out on anything the scanner can't resolve."""
+        documents = 0
+        for event in yaml.parse(content, Loader=_Loader):
+            if isinstance(event, yaml.DocumentStartEvent):
+                documents += 1
+                if documents > 1:
+                    raise _NeedsFullLoad()
+            elif isinstance(event, yaml.AliasEvent):
+                raise _NeedsFullLoad()
+            elif isinstance(event, yaml.NodeEvent) and event.tag not in (None, '!') \
+                    and not event.tag.startswith('tag:yaml.org,2002:'):
+                raise _NeedsFullLoad()
+            yield event
+
+    def _scan_top_level(self, events, referenced: Set[str]) -> None:
+        """Collect reference fields from the top-level mapping."""
+        # Like safe_load, a duplicated key only keeps its last value
+        fields = {}
+        for key, value_event in self._mapping_items(events):
+            if key not in self.FILE_REFERENCE_FIELDS or not isinstance(value_event, yaml.SequenceStartEvent):
+                fields.pop(key, None)
+                self._skip_node(value_event, events)
+                continue
+
+            items = []
+            for item_event in events:
+                if isinstance(item_event, yaml.SequenceEndEvent):
+                    break
+                items.append(self._read_list_item(item_event, events))
+            fields[key] = items
+
+        for field, items in fields.items():
+            for item in items:
+                self._extract_file_reference(item, referenced)
+
+                # Handle patches with target
+                if field == 'patches' and isinstance(item, dict) and 'path' in item:
+                    self._add_local_file(item['path'], referenced)
+
+    def _read_list_item(self, event, events):
+        """Read a list item, keeping only the keys that can reference files."""
+        if isinstance(event, yaml.ScalarEvent):
+            return _scalar_value(event)
+        if not isinstance(event, yaml.MappingStartEvent):
+            self._skip_node(event, events)
+            return None
+
+        item = {}
+        for key, value_event in self._mapping_items(events):
+            item.pop(key, None)
+            if key == 'path' and isinstance(value_event, yaml.ScalarEvent):
+                item['path'] = _scalar_value(value_event)
+            elif key == 'files' and isinstance(value_event, yaml.SequenceStartEvent):
+                files = []
+                for file_event in events:
+                    if isinstance(file_event, yaml.SequenceEndEvent):
+                        break
+                    if isinstance(file_event, yaml.ScalarEvent):
+                        files.append(_scalar_value(file_event))
+                    else:
+                        self._skip_node(file_event, events)
+                item['files'] = files
+            else:
+                self._skip_node(value_event, events)
+        return item
+
+    def _mapping_items(self, events):
+        """Yield (key, value_start_event) pairs until the current mapping ends."""
+        for key_event in events:
+            if isinstance(key_event, yaml.MappingEndEvent):
+                return
+            if isinstance(key_event, yaml.ScalarEvent):
+                if _resolve_tag(key_event) == 'tag:yaml.org,2002:merge':
+                    raise _NeedsFullLoad()
+                key = _scalar_value(key_event)
+            else:
+                self._skip_node(key_event, events)
+                key = None
+            yield key, next(events)
+
+    @staticmethod
+    def _skip_node(event, events) -> None:
+        """Consume the remaining events of the node started by event."""
+        depth = 1 if isinstance(event, yaml.CollectionStartEvent) else 0
+        while depth:
+            event = next(events)
+            if isinstance(event, yaml.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
 
     def _extract_file_reference(self, item, referenced: Set[str]) -> None:
         """Extract file reference from a YAML item."""
@@ -122,6 +320,12 @@ class KustomizationParser:
             referenced.add(match.group(1))
 
 
+@functools.lru_cache(maxsize=4096)
+def _cached_referenced_files(path: str, mtime_ns: int, size: int) -> FrozenSet[str]:
+    """Parse a kustomization.yaml once per (path, mtime, size) triple."""
+    return frozenset(KustomizationParser(Path(path))._read_referenced_files())
+
+
 class UnreferencedFileAnalyzer:
     """Analyzes unreferenced files to determine if they're safe to remove."""
 
@@ -137,6 +341,15 @@ class UnreferencedFileAnalyzer:
     # Test/example patterns
     TEST_PATTERNS = ['test', 'example', 'sample', '.bak', '.old']
 
+    # Files larger than this are left for review instead of being scanned,
+    # even when their name matches a safe-to-remove pattern
+    SCAN_LIMIT = 64 * 1024
+
+    # Each pattern list merged into a single alternation, compiled once
+    _IMPORTANT_RE = re.compile('|'.join(map(re.escape, IMPORTANT_MARKERS)).encode())
+    _SAFE_RE = re.compile('|'.join(map(re.escape, SAFE_PATTERNS)))
+    _TEST_RE = re.compile('|'.join(map(re.escape, TEST_PATTERNS)), re.IGNORECASE)
+
     def __init__(self, project_root: Path):
         self.project_root = project_root
         self.manifests_dir = project_root / "manifests"
@@ -145,66 +358,84 @@ class UnreferencedFileAnalyzer:
         """Find all unreferenced YAML files in the project."""
         all_unreferenced = []
 
-        # Find all kustomization.yaml files
-        for kustomization_path in self.manifests_dir.rglob("kustomization.yaml"):
-            directory = kustomization_path.parent
-            unreferenced = self._find_unreferenced_in_directory(directory)
-            all_unreferenced.extend(unreferenced)
-
-        return sorted(all_unreferenced)
-
-    def _find_unreferenced_in_directory(self, directory: Path) -> List[Path]:
-        """Find unreferenced files in a specific directory."""
-        kustomization_path = directory / 'kustomization.yaml'
+        # Find all kustomization.yaml files along with their sibling YAML files
+        found = list(_scandir_recursive(self.manifests_dir))
 
-        if not kustomization_path.exists():
-            return []
+        # Each directory is independent, so parse them concurrently
+        with ThreadPoolExecutor() as executor:
+            for unreferenced in executor.map(self._find_unreferenced_in_directory, found):
+                all_unreferenced.extend(unreferenced)
 
-        # Get all YAML files in directory (not in subdirs)
-        yaml_files = []
-        for file in directory.iterdir():
-            if file.is_file() and file.suffix in ('.yaml', '.yml') and file.name != 'kustomization.yaml':
-                yaml_files.append(file.name)
+        return sorted(all_unreferenced, key=os.fspath)
 
+    def _find_unreferenced_in_directory(self, found: KustomizeDirectory) -> List[Path]:
+        """Find unreferenced files among the YAML files of a kustomize directory."""
         # Get referenced files
-        parser = KustomizationParser(kustomization_path)
+        parser = KustomizationParser(found.kustomization_path)
         referenced = parser.get_referenced_files()
 
         # Find unreferenced files
         unreferenced = []
-        for filename in yaml_files:
+        for filename in found.yaml_files:
             if filename not in referenced:
-                unreferenced.append(directory / filename)
+                unreferenced.append(found.directory / filename)
 
         return unreferenced
 
     def analyze_file(self, filepath: Path) -> AnalysisResult:
-        """Analyze a file to determine if it's safe to remove."""
+        """Analyze a file to determine if it's safe to remove.
+
+        Files larger than SCAN_LIMIT are never marked safe to remove, whatever
+        their name; they are always left for manual review.
+        """
         try:
-            content = filepath.read_text(encoding='utf-8')
+            with open(filepath, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                # mmap refuses empty files, and there is nothing to scan anyway
+                if size == 0:
+                    return self._classify(filepath, b'')
+                # Never mark a file safe without having scanned all of it
+                if size > self.SCAN_LIMIT:
+                    return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW,
+                                          f"File too large to scan fully (over {self.SCAN_LIMIT // 1024} KiB)")
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self._classify(filepath, mm)
+        except Exception as e:
+            return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, f"Error reading file: {e}")
 
-            # Check for important markers
-            if any(marker in content for marker in self.IMPORTANT_MARKERS):
-                return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, "Contains important markers")
+    def _classify(self, filepath: Path, content) -> AnalysisResult:
+        """Classify a file from its raw bytes without decoding them."""
+        fp_str = os.fspath(filepath)
 
-            # Check if it's a Job that was replaced
-            if 'kind: Job' in content:
-                if 'job-' in filepath.name or '-job' in filepath.name:
-                    return AnalysisResult(filepath, FileStatus.SAFE_TO_REMOVE, "Old Job file (likely replaced by workflow)")
+        # Check for important markers
+        if self._IMPORTANT_RE.search(content):
+            return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, "Contains important markers")
 
-            # Check for old patterns
-            if any(pattern in str(filepath) for pattern in self.SAFE_PATTERNS):
-                return AnalysisResult(filepath, FileStatus.SAFE_TO_REMOVE, "Matches old job pattern")
+        # Check if it's a Job that was replaced
+        if content.find(b'kind: Job') != -1:
+            if 'job-' in filepath.name or '-job' in filepath.name:
+                return self._safe_to_remove(filepath, content, "Old Job file (likely replaced by workflow)")
 
-            # Check if it's a test or example file
-            if any(pattern in filepath.name.lower() for pattern in self.TEST_PATTERNS):
-                return AnalysisResult(filepath, FileStatus.SAFE_TO_REMOVE, "Test/example/backup file")
+        # Check for old patterns
+        if self._SAFE_RE.search(fp_str):
+            return self._safe_to_remove(filepath, content, "Matches old job pattern")
 
-        except Exception as e:
-            return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, f"Error reading file: {e}")
+        # Check if it's a test or example file
+        if self._TEST_RE.search(filepath.name):
+            return self._safe_to_remove(filepath, content, "Test/example/backup file")
 
         return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, "Unknown file - manual review needed")
 
+    def _safe_to_remove(self, filepath: Path, content, reason: str) -> AnalysisResult:
+        """Mark a file safe to remove, unless its content isn't valid UTF-8."""
+        # Only removal candidates pay for decoding; anything unreadable as
+        # text stays in review, as it did when files were read with read_text
+        try:
+            codecs.utf_8_decode(content, 'strict', True)
+        except UnicodeDecodeError as e:
+            return AnalysisResult(filepath, FileStatus.NEEDS_REVIEW, f"Error reading file: {e}")
+        return AnalysisResult(filepath, FileStatus.SAFE_TO_REMOVE, reason)
+
 
 def main():
     """Main entry point."""
@@ -229,11 +460,9 @@ def main():
         print("No unreferenced files found!")
         return
 
-    # Analyze each file
-    results = []
-    for filepath in unreferenced_files:
-        result = analyzer.analyze_file(filepath)
-        results.append(result)
+    # Analyze each file (I/O bound and stateless, so threads overlap the reads)
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4)) as executor:
+        results = list(executor.map(analyzer.analyze_file, unreferenced_files))
 
     # Display results
     print("\n=== Unreferenced YAML Files Analysis ===\n")
@@ -242,15 +471,15 @@ def main():
     needs_review = []
 
     for result in results:
-        rel_path = result.filepath.relative_to(project_root)
+        result.rel_path = os.path.relpath(result.filepath, project_root)
 
         if result.status == FileStatus.SAFE_TO_REMOVE:
             safe_to_remove.append(result)
-            print(f"✓ SAFE TO REMOVE: {rel_path}")
+            print(f"✓ SAFE TO REMOVE: {result.rel_path}")
             print(f"  Reason: {result.reason}")
         else:
             needs_review.append(result)
-            print(f"⚠ NEEDS REVIEW: {rel_path}")
+            print(f"⚠ NEEDS REVIEW: {result.rel_path}")
             print(f"  Reason: {result.reason}")
         print()
 
@@ -262,17 +491,17 @@ def main():
     if safe_to_remove:
         print("\nFiles safe to remove:")
         for result in safe_to_remove:
-            print(f"  {result.filepath.relative_to(project_root)}")
+            print(f"  {result.rel_path}")
 
     if needs_review:
         print("\nFiles needing review:")
         for result in needs_review:
-            print(f"  {result.filepath.relative_to(project_root)}")
+            print(f"  {result.rel_path}")
 
     # Optional: Generate removal command
     if safe_to_remove:
         print("\nTo remove safe files, run:")
-        files_to_remove = ' '.join(f'"{r.filepath.relative_to(project_root)}"' for r in safe_to_remove)
+        files_to_remove = ' '.join(f'"{r.rel_path}"' for r in safe_to_remove)
         print(f"  rm {files_to_remove}")
 
 